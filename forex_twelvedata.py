@@ -1,9 +1,15 @@
 import requests
-import psycopg2
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import psycopg
 from datetime import datetime
 from dotenv import load_dotenv
 import logging
 import os
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 # --- LOAD ENV ---
 load_dotenv()
@@ -32,6 +38,16 @@ formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+# Reuse one connection to the API instead of a new TLS handshake per request
+SESSION = requests.Session()
+SESSION.headers['Connection'] = 'keep-alive'
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET'], respect_retry_after_header=True)
+))
+
 # --- FETCH DATA ---
 def fetch_forex_data():
     params = {
@@ -43,10 +59,10 @@ def fetch_forex_data():
     
     try:
         logger.info(f"Requesting data for {SYMBOL} at interval {INTERVAL}")
-        response = requests.get(API_URL, params=params)
+        response = SESSION.get(API_URL, params=params, timeout=20)
         response.raise_for_status()  # Raise error for bad status codes
 
-        data = response.json()
+        data = json_loads(response.content)
         logger.info("Data fetched successfully")
         return data['values'][0]
 
@@ -84,7 +100,7 @@ def fetch_forex_data():
 
 # --- INSERT INTO DB ---
 def insert_into_db(metrics):
-    conn = psycopg2.connect(**DB_CONFIG)
+    conn = psycopg.connect(**DB_CONFIG)
     cur = conn.cursor()
     cur.execute("""
         INSERT INTO forex_data (
@@ -1,11 +1,27 @@
+import asyncio
+import atexit
+import hashlib
+import json
 import os
 import sys
+import time
+from collections import namedtuple
 import logging
 from datetime import datetime, timezone
+from types import MappingProxyType
+from zoneinfo import ZoneInfo
 
+import httpx
+import numpy as np
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional; stdlib json also accepts bytes
+    from json import loads as json_loads
 import requests
-import psycopg2
-from psycopg2.extras import execute_values
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import psycopg
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
 # -------- Config from environment (GitHub Secrets) --------
 # Only API_KEY is required when SKIP_DB=1 (testing mode).
@@ -29,12 +45,45 @@ DB_CONFIG = {
 }
 
 SYMBOL = os.getenv("SYMBOL", "EUR/USD")
+# Comma-separated list, e.g. "EUR/USD,GBP/USD"; more than one symbol is fetched concurrently.
+SYMBOLS = [s.strip() for s in os.getenv("SYMBOLS", SYMBOL).split(",") if s.strip()]
 INTERVAL = os.getenv("INTERVAL", "1min")
 API_URL = "https://api.twelvedata.com/time_series"
 
+# Query params shared by every request; only symbol/outputsize vary per call.
+_BASE_PARAMS = MappingProxyType({"interval": INTERVAL, "apikey": API_KEY, "timezone": "UTC"})
+
+# Batches at least this large are bulk-loaded with COPY; smaller ones use a pipelined executemany.
+COPY_THRESHOLD = 1024
+
+# Newest ingested bar per symbol; older bars are dropped before parsing, so an idle tick
+# re-parses just that one bar and the LAST_HASH_FILE check below decides whether to skip the DB.
+# Entries older than LAST_BAR_MAX_AGE_MIN are ignored so the window gets re-upserted.
+LAST_BAR_FILE = os.getenv("LAST_BAR_FILE", ".last_bar")
+LAST_BAR_MAX_AGE_MIN = int(os.getenv("LAST_BAR_MAX_AGE_MIN", "60"))
+
+# Digest of the last upserted batch; an identical batch skips the DB entirely.
+LAST_HASH_FILE = os.getenv("LAST_HASH_FILE", ".last_hash")
+
 # -------- Logging --------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 log = logging.getLogger("gha_run")
+logging.getLogger("httpx").setLevel(logging.WARNING)  # its INFO lines include the apikey query param
+
+# -------- HTTP session (keeps the TLS connection to TwelveData alive) --------
+SESSION = requests.Session()
+SESSION.headers["Connection"] = "keep-alive"
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    ),
+))
 
 DDL = """
 CREATE TABLE IF NOT EXISTS forex_bars (
@@ -53,106 +102,235 @@ CREATE TABLE IF NOT EXISTS forex_bars (
 );
 """
 
-def ensure_table():
-    conn = psycopg2.connect(**DB_CONFIG)
+# Scoped to each transaction and sent together with its first statement. (Not a libpq startup
+# option: transaction poolers in front of most cloud Postgres reject those.)
+SET_TIMEOUT = "SET LOCAL statement_timeout = '15s';"
+
+# Written after the DDL has run once; keyed by the DDL and DB target so a schema change or a
+# different/recreated database re-runs it.
+_SCHEMA_KEY = f"{DDL}{DB_CONFIG['host']}{DB_CONFIG['port']}{DB_CONFIG['dbname']}"
+SCHEMA_SENTINEL = f".schema_{hashlib.sha256(_SCHEMA_KEY.encode()).hexdigest()[:12]}_ok"
+
+_conn = None
+
+def get_conn():
+    """Return the process-wide DB connection, opening it on first use."""
+    global _conn
+    if _conn is None or _conn.closed:
+        _conn = psycopg.connect(**DB_CONFIG)
+        atexit.register(_conn.close)
+    return _conn
+
+def ensure_table(conn):
+    # psycopg 3: "with conn" would close the connection, so scope the transaction explicitly
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(SET_TIMEOUT + DDL)
+
+def _read_last_bar_cache():
     try:
-        with conn, conn.cursor() as cur:
-            cur.execute("SET statement_timeout = '15s';")
-            cur.execute(DDL)
-        conn.commit()
-    finally:
-        conn.close()
-
-def fetch_bars(outputsize=10):
-    params = {
-        "symbol": SYMBOL,
-        "interval": INTERVAL,
-        "apikey": API_KEY,
-        "outputsize": outputsize,
-        "timezone": "UTC",
-    }
-    log.info("Requesting last %s bars for %s @ %s", outputsize, SYMBOL, INTERVAL)
-    r = requests.get(API_URL, params=params, timeout=20)
-    r.raise_for_status()
-    data = r.json()
+        with open(LAST_BAR_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def last_seen(symbol):
+    """Return the cached newest bar datetime ('%Y-%m-%d %H:%M:%S') for symbol, or None if absent/stale."""
+    entry = _read_last_bar_cache().get(symbol)
+    if not entry or time.time() - entry.get("saved_at", 0) > LAST_BAR_MAX_AGE_MIN * 60:
+        return None
+    return entry.get("datetime")
+
+def save_last_seen(latest):
+    """Record the newest upserted datetime for each symbol in latest ({symbol: dt})."""
+    cache = _read_last_bar_cache()
+    now = time.time()
+    for symbol, dt in latest.items():
+        cache[symbol] = {"datetime": dt.strftime("%Y-%m-%d %H:%M:%S"), "saved_at": now}
+    with open(LAST_BAR_FILE, "w") as f:
+        json.dump(cache, f)
 
+_UTC = timezone.utc
+
+Bar = namedtuple("Bar", "symbol dt open high low close")
+
+def _parse(s):
+    """Parse TwelveData's fixed 'YYYY-MM-DD HH:MM:SS' timestamp as UTC."""
+    return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                    int(s[11:13]), int(s[14:16]), int(s[17:19]), tzinfo=_UTC)
+
+def _params(symbol, outputsize):
+    return {**_BASE_PARAMS, "symbol": symbol, "outputsize": outputsize}
+
+class TwelveDataTransientError(RuntimeError):
+    """status=error payload with a rate-limit (429) or server-side (5xx) code."""
+
+def _is_transient_status(code):
+    return isinstance(code, int) and (code == 429 or code >= 500)
+
+def _is_transient(exc):
+    """Retry only failures that may clear up; bad apikey/symbol or other 4xx would just burn credits."""
+    if isinstance(exc, (TwelveDataTransientError, httpx.TransportError)):
+        return True
+    return isinstance(exc, httpx.HTTPStatusError) and _is_transient_status(exc.response.status_code)
+
+def _parse_bars(data, symbol):
     if isinstance(data, dict) and data.get("status") == "error":
+        if _is_transient_status(data.get("code")):
+            raise TwelveDataTransientError(f"TwelveData error: {data.get('message')}")
         raise RuntimeError(f"TwelveData error: {data.get('message')}")
 
     values = data.get("values") or []
+    since = last_seen(symbol)
+    if since:
+        # TwelveData timestamps are fixed-width, so string order == time order. Keep the
+        # last-ingested bar (>=): it was usually still forming and needs its closed OHLC.
+        values = [row for row in values if row["datetime"] >= since]
     bars = []
     for row in reversed(values):  # process oldest -> newest
-        dt = datetime.strptime(row["datetime"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
-        bars.append({
-            "symbol": SYMBOL,
-            "datetime": dt,
-            "open": float(row["open"]),
-            "high": float(row["high"]),
-            "low": float(row["low"]),
-            "close": float(row["close"]),
-        })
-    log.info("Fetched bars: %s", ", ".join(b["datetime"].strftime("%Y-%m-%d %H:%M:%S") for b in bars))
+        bars.append(Bar(symbol, _parse(row["datetime"]), float(row["open"]),
+                        float(row["high"]), float(row["low"]), float(row["close"])))
+    if log.isEnabledFor(logging.INFO):
+        log.info("Fetched bars: %s", ", ".join(b.dt.isoformat(sep=" ", timespec="seconds") for b in bars))
     return bars
 
-def add_metrics(bar):
-    open_, high, low, close = bar["open"], bar["high"], bar["low"], bar["close"]
-    pip_hl = (high - low) * 10000.0
-    pip_oc = (close - open_) * 10000.0
-    confidence_score = abs(pip_oc) / pip_hl if pip_hl != 0 else 0.0
-    confidence_tag = "high" if confidence_score > 0.7 else "low"
-    out = dict(bar)
-    out.update(
-        pip_hl=pip_hl,
-        pip_oc=pip_oc,
-        confidence_score=confidence_score,
-        confidence_tag=confidence_tag,
-    )
-    return out
-
-def upsert_rows(rows):
-    if not rows:
-        log.info("No rows to upsert.")
-        return
+def bars_digest(bars):
+    """Cheap content hash over the newest bar per symbol (datetime, high, low, close).
 
-    sql = """
-        INSERT INTO forex_bars
-        (symbol, "datetime", open, high, low, close, pip_hl, pip_oc, confidence_score, confidence_tag)
-        VALUES %s
-        ON CONFLICT (symbol, "datetime") DO UPDATE SET
-            open = EXCLUDED.open,
-            high = EXCLUDED.high,
-            low  = EXCLUDED.low,
-            close = EXCLUDED.close,
-            pip_hl = EXCLUDED.pip_hl,
-            pip_oc = EXCLUDED.pip_oc,
-            confidence_score = EXCLUDED.confidence_score,
-            confidence_tag = EXCLUDED.confidence_tag;
+    Older bars in the window are already closed, so only the trailing, possibly still-forming
+    bar can change; hashing just it makes a full upserted batch and the 1-bar idle batch
+    (see the >= filter in _parse_bars) compare equal.
     """
-    vals = [(
-        r["symbol"], r["datetime"], r["open"], r["high"], r["low"], r["close"],
-        r["pip_hl"], r["pip_oc"], r["confidence_score"], r["confidence_tag"]
-    ) for r in rows]
+    newest = {b.symbol: b for b in bars}  # bars are oldest -> newest per symbol
+    payload = "".join(f"{b.symbol}{b.dt.isoformat()}{b.high!r}{b.low!r}{b.close!r}"
+                      for _, b in sorted(newest.items()))
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
 
-    conn = psycopg2.connect(**DB_CONFIG)
+def _read_last_hash():
     try:
-        with conn, conn.cursor() as cur:
-            cur.execute("SET statement_timeout = '15s';")
-            execute_values(cur, sql, vals)
-        conn.commit()
-    finally:
-        conn.close()
+        with open(LAST_HASH_FILE) as f:
+            return f.read().strip()
+    except OSError:
+        return None
 
+_NEW_YORK = ZoneInfo("America/New_York")
+
+def fx_market_closed(now):
+    """True during the FX weekend: Fri 17:00 -> Sun 17:00 New York time (21:00/22:00 UTC with DST)."""
+    ny = now.astimezone(_NEW_YORK)
+    wd, h = ny.weekday(), ny.hour
+    return wd == 5 or (wd == 4 and h >= 17) or (wd == 6 and h < 17)
+
+def fetch_bars(outputsize=10, symbol=SYMBOL):
+    log.info("Requesting last %s bars for %s @ %s", outputsize, symbol, INTERVAL)
+    r = SESSION.get(API_URL, params=_params(symbol, outputsize), timeout=20)
+    r.raise_for_status()
+    return _parse_bars(json_loads(r.content), symbol)
+
+async def fetch_bars_async(client, symbol, outputsize=10):
+    log.info("Requesting last %s bars for %s @ %s", outputsize, symbol, INTERVAL)
+    r = await client.get(API_URL, params=_params(symbol, outputsize))
+    r.raise_for_status()
+    return _parse_bars(json_loads(r.content), symbol)
+
+async def fetch_all(symbols, outputsize=10):
+    """Fetch every symbol concurrently over one pooled HTTP/2 client; bars are concatenated."""
+    limits = httpx.Limits(max_keepalive_connections=8, max_connections=16)
+    async with httpx.AsyncClient(http2=True, limits=limits, timeout=20) as client:
+        results = await asyncio.gather(*[fetch_bars_async(client, s, outputsize) for s in symbols])
+    return [b for bars in results for b in bars]
+
+# Indexed by (confidence_score > 0.7); object dtype so .tolist() reuses the two str objects.
+TAG_LUT = np.array(["low", "high"], dtype=object)
+
+def compute_metrics(bars):
+    """Compute pip/confidence metrics for all bars at once.
+
+    Returns the upsert columns (symbols, dts, o, h, l, c, pip_hl, pip_oc, cs, tag);
+    the numeric ones stay NumPy arrays.
+    """
+    n = len(bars)
+    o, h, l, c = (np.fromiter((getattr(b, k) for b in bars), dtype=np.float64, count=n)
+                  for k in ("open", "high", "low", "close"))
+    pip_hl = (h - l) * 10000.0
+    pip_oc = (c - o) * 10000.0
+    cs = np.divide(np.abs(pip_oc), pip_hl, out=np.zeros(n), where=pip_hl != 0)
+    tag = TAG_LUT[(cs > 0.7).astype(np.int8)]
+    symbols = [b.symbol for b in bars]
+    dts = [b.dt for b in bars]
+    return symbols, dts, o, h, l, c, pip_hl, pip_oc, cs, tag
+
+COLUMNS = 'symbol, "datetime", open, high, low, close, pip_hl, pip_oc, confidence_score, confidence_tag'
+
+UPSERT_SET = """
+    ON CONFLICT (symbol, "datetime") DO UPDATE SET
+        open = EXCLUDED.open,
+        high = EXCLUDED.high,
+        low  = EXCLUDED.low,
+        close = EXCLUDED.close,
+        pip_hl = EXCLUDED.pip_hl,
+        pip_oc = EXCLUDED.pip_oc,
+        confidence_score = EXCLUDED.confidence_score,
+        confidence_tag = EXCLUDED.confidence_tag;
+"""
+
+# Binary COPY types for the staging table, in COLUMNS order.
+COPY_TYPES = ["varchar", "timestamptz"] + ["float8"] * 7 + ["text"]
+
+def copy_upsert(cur, vals):
+    """Bulk-load vals into a temp staging table with COPY, then merge into forex_bars."""
+    cur.execute(SET_TIMEOUT + f"CREATE TEMP TABLE forex_bars_stage ON COMMIT DROP AS SELECT {COLUMNS} FROM forex_bars WITH NO DATA;")
+    with cur.copy(f"COPY forex_bars_stage ({COLUMNS}) FROM STDIN WITH (FORMAT binary)") as copy:
+        copy.set_types(COPY_TYPES)
+        for v in vals:
+            copy.write_row(v)
+    cur.execute(f"INSERT INTO forex_bars ({COLUMNS}) SELECT {COLUMNS} FROM forex_bars_stage" + UPSERT_SET)
+
+UPSERT_SQL = f"INSERT INTO forex_bars ({COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)" + UPSERT_SET
+
+def upsert_rows(conn, symbols, dts, o, h, l, c, pip_hl, pip_oc, cs, tag):
+    n = len(dts)
+    if not n:
+        log.info("No rows to upsert.")
+        return
+
+    vals = zip(symbols, dts, o.tolist(), h.tolist(), l.tolist(), c.tolist(),
+               pip_hl.tolist(), pip_oc.tolist(), cs.tolist(), tag.tolist())
+
+    with conn.transaction(), conn.cursor() as cur:
+        if n >= COPY_THRESHOLD:
+            copy_upsert(cur, vals)
+        else:
+            # psycopg 3 prepares the statement and pipelines the SET and every row in one round-trip
+            with conn.pipeline():
+                cur.execute(SET_TIMEOUT)
+                cur.executemany(UPSERT_SQL, vals)
+
+# TwelveData reports rate limits / outages as status=error on a 200 response, which the HTTP
+# adapter can't see; the async path has no adapter-level retries at all.
+@retry(
+    retry=retry_if_exception(_is_transient),
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(min=1, max=30),
+    reraise=True,
+)
 def main():
-    bars = fetch_bars(outputsize=10)
+    if fx_market_closed(datetime.now(timezone.utc)):
+        log.info("FX market closed; nothing to fetch.")
+        return
+
+    if len(SYMBOLS) > 1:
+        bars = asyncio.run(fetch_all(SYMBOLS, outputsize=10))
+    else:
+        bars = fetch_bars(outputsize=10, symbol=SYMBOLS[0])
     if not bars:
         print("No bars fetched.")
         return
 
-    rows = [add_metrics(b) for b in bars]
+    cols = compute_metrics(bars)
 
     if SKIP_DB:
         print("SKIP_DB=1 -> not inserting. Last timestamps:",
-              ", ".join(b["datetime"].strftime("%Y-%m-%d %H:%M:%S") for b in bars[-5:]))
+              ", ".join(b.dt.strftime("%Y-%m-%d %H:%M:%S") for b in bars[-5:]))
         return
 
     # Ensure DB secrets exist before connect
@@ -162,9 +340,30 @@ def main():
         print(f"Missing DB secrets: {', '.join(missing_db)}", file=sys.stderr)
         sys.exit(1)
 
-    ensure_table()
-    upsert_rows(rows)
-    print(f"Upserted {len(rows)} rows up to {rows[-1]['datetime']:%Y-%m-%d %H:%M:%S %Z}")
+    latest = {b.symbol: b.dt for b in bars}  # bars are oldest -> newest per symbol
+    digest = bars_digest(bars)
+    if digest == _read_last_hash():
+        log.info("Bars unchanged since last upsert; skipping DB.")
+        save_last_seen(latest)  # keep the last-bar filter from expiring while data is idle
+        return
+
+    conn = get_conn()
+    if not os.path.exists(SCHEMA_SENTINEL):
+        ensure_table(conn)
+        open(SCHEMA_SENTINEL, "w").close()
+    try:
+        upsert_rows(conn, *cols)
+    except psycopg.errors.UndefinedTable:
+        # Stale sentinel (e.g. the database was recreated): rebuild the schema and retry once
+        log.warning("forex_bars missing despite %s; re-running DDL.", SCHEMA_SENTINEL)
+        os.remove(SCHEMA_SENTINEL)
+        ensure_table(conn)
+        open(SCHEMA_SENTINEL, "w").close()
+        upsert_rows(conn, *cols)
+    save_last_seen(latest)
+    with open(LAST_HASH_FILE, "w") as f:
+        f.write(digest)
+    print(f"Upserted {len(bars)} rows up to {max(latest.values()):%Y-%m-%d %H:%M:%S %Z}")
 
 if __name__ == "__main__":
     try: